@@ -8,7 +8,10 @@ https://github.com/vroomfonde1/basicmodem
 """
 import asyncio
 import logging
+import re
+import time
 import wave
+from collections import deque
 from collections.abc import Callable
 from datetime import datetime
 
@@ -21,11 +24,52 @@ DEFAULT_PORT = "/dev/ttyACM0"
 DEFAULT_CMD_CALLERID = "AT+VCID=1"
 READ_RING_TIMEOUT = 10
 READ_IDLE_TIMEOUT = None
+MAX_RESPONSE_LINES = 64
+RETRY_DELAY = 10
+RETRY_MAX_DELAY = 60
+
+_TERMINALS = frozenset((b"OK", b"ERROR"))
+_RING = b"RING"
+_TAG_DATE = b"DATE"
+_TAG_NMBR = b"NMBR"
+_TAG_NAME = b"NAME"
+_CID_RE = re.compile(rb"\s*(\w+)\s*=\s*(.*?)\s*")
+
+_CMD_AT = b"AT\r\n"
+_CMD_ATA = b"ATA\r\n"
+_CMD_ATH = b"ATH\r\n"
+_CMD_VSM_QUERY = b"AT+VSM=?\r\n"
+_CMD_FCLASS = {0: b"AT+FCLASS=0\r\n", 8: b"AT+FCLASS=8\r\n"}
+
+# Encoded, terminated form of each command string, built on first use
+_CMD_CACHE: dict[str, bytes] = {
+    DEFAULT_CMD_CALLERID: f"{DEFAULT_CMD_CALLERID}\r\n".encode()
+}
 
 
 class PhoneModem:  # pylint: disable=too-many-instance-attributes
     """Implementation of modem."""
 
+    __slots__ = (
+        "port",
+        "incomingcallnotificationfunc",
+        "retry",
+        "state",
+        "cmd_callerid",
+        "cmd_response",
+        "cmd_responselines",
+        "_cid_time_ns",
+        "cid_name",
+        "cid_number",
+        "ser",
+        "vsm_method",
+        "_buf",
+        "_line_queue",
+        "_read_timeout",
+        "_resp_event",
+        "_sm_task",
+    )
+
     STATE_IDLE = "idle"
     STATE_RING = "ring"
     STATE_CALLERID = "callerid"
@@ -46,12 +90,17 @@ class PhoneModem:  # pylint: disable=too-many-instance-attributes
         self.state: str = self.STATE_FAILED
         self.cmd_callerid = DEFAULT_CMD_CALLERID
         self.cmd_response = ""
-        self.cmd_responselines: list[str] = []
-        self.cid_time = datetime.now()
+        self.cmd_responselines: deque[str] = deque(maxlen=MAX_RESPONSE_LINES)
+        self._cid_time_ns = time.time_ns()
         self.cid_name: str = ""
         self.cid_number: str = ""
         self.ser = None
         self.vsm_method = 1
+        self._buf = bytearray()
+        self._line_queue: deque[bytes] = deque()
+        self._read_timeout: float | None = None
+        self._resp_event = asyncio.Event()
+        self._sm_task: asyncio.Task | None = None
 
     async def test(self, port: str = DEFAULT_PORT) -> None:
         """Test the modem."""
@@ -67,10 +116,13 @@ class PhoneModem:  # pylint: disable=too-many-instance-attributes
             self.ser = None
             raise exceptions.SerialError from ex
 
-        asyncio.create_task(self._modem_sm())
+        self._buf.clear()
+        self._line_queue.clear()
+        self._read_timeout = self.ser.timeout
+        self._sm_task = asyncio.create_task(self._modem_sm())
 
         try:
-            await self._sendcmd("AT")
+            await self._sendcmd(_CMD_AT)
             if self._get_response() == "":
                 _LOGGER.error("No response from modem on port %s", port)
                 await self.close()
@@ -80,13 +132,11 @@ class PhoneModem:  # pylint: disable=too-many-instance-attributes
                 _LOGGER.error("Error enabling caller id on modem")
                 await self.close()
                 raise exceptions.ResponseError
-            if _LOGGER.level == 10:
+            if _LOGGER.isEnabledFor(logging.DEBUG):
                 await self._sendcmd("ATE1")
             await self._set_class()
-            for i in await self._sendcmd("AT+VSM=?"):
-                if '128,"8-BIT LINEAR"' in i:
-                    self.vsm_method = 128
-                    break
+            if '128,"8-BIT LINEAR"' in "\n".join(await self._sendcmd(_CMD_VSM_QUERY)):
+                self.vsm_method = 128
             await self._set_class(0)
 
         except SerialException:
@@ -98,6 +148,11 @@ class PhoneModem:  # pylint: disable=too-many-instance-attributes
 
         _LOGGER.debug("Opening port %s", port)
 
+    @property
+    def cid_time(self) -> datetime:
+        """Return the time of the last incoming call."""
+        return datetime.fromtimestamp(self._cid_time_ns / 1e9)
+
     def registercallback(self, incomingcallback: Callable | None = None) -> None:
         """Register/unregister callback."""
         self.incomingcallnotificationfunc = (
@@ -105,35 +160,64 @@ class PhoneModem:  # pylint: disable=too-many-instance-attributes
         )
 
     async def _read(self, timeout: float = 1.0) -> bytes:
-        """Read from modem port, return null string on timeout."""
-        if self.ser:
-            self.ser.timeout = timeout
-        else:
-            return b""
-        return await self.ser.readline_async()
+        """Read a line from modem port, return null string on timeout.
 
-    async def _write(self, cmd: str = "AT") -> int:
-        """Write string to modem, returns number of bytes written."""
+        Everything waiting on the port is read in one go and split into
+        lines, so a burst of responses costs a single read. The port timeout
+        is only reconfigured when it changes."""
+        if (ser := self.ser) is None:
+            return b""
+        if timeout != self._read_timeout:
+            ser.timeout = self._read_timeout = timeout
+        while not self._line_queue:
+            data = await ser.read_async(ser.in_waiting or 1)
+            if not data:
+                return b""
+            self._buf += data
+            start = 0
+            while end := self._buf.find(b"\n", start) + 1:
+                self._line_queue.append(bytes(self._buf[start:end]))
+                start = end
+            del self._buf[:start]
+        return self._line_queue.popleft()
+
+    async def _write(self, cmd: str | bytes = _CMD_AT) -> int:
+        """Write command to modem, returns number of bytes written.
+
+        Commands given as bytes are written as is and must include the terminator."""
         self.cmd_response = ""
-        self.cmd_responselines = []
+        self.cmd_responselines.clear()
+        self._resp_event.clear()
         if self.ser is None:
             return 0
-        cmd += "\r\n"
-        return await self.ser.write_async(cmd.encode())
-
-    async def _sendcmd(self, cmd: str = "AT", timeout: float = 1.0) -> list[str]:
+        if isinstance(cmd, bytes):
+            payload = cmd
+        elif (payload := _CMD_CACHE.get(cmd)) is None:
+            payload = _CMD_CACHE[cmd] = f"{cmd}\r\n".encode()
+        return await self.ser.write_async(payload)
+
+    async def _sendcmd(
+        self, cmd: str | bytes = _CMD_AT, timeout: float = 1.0
+    ) -> list[str]:
         """Send command, wait for response. returns response from modem."""
         if await self._write(cmd):
-            while self._get_response() == "" and timeout > 0:
-                await asyncio.sleep(0.1)
-                timeout -= 0.1
+            try:
+                await asyncio.wait_for(self._resp_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
         return self._get_lines()
 
+    async def _sendcmd_batch(self, cmds: list[str], timeout: float = 1.0) -> list[str]:
+        """Send several commands on one command line, wait for the single response."""
+        return await self._sendcmd(
+            "AT" + ";".join(cmd.removeprefix("AT") for cmd in cmds), timeout
+        )
+
     def _placeholdercallback(self, newstate: str) -> None:
         """Do nothing."""
         _LOGGER.debug("placeholder callback: %s", newstate)
 
-    async def _set_state(self, state: str) -> None:
+    def _set_state(self, state: str) -> None:
         """Set the state."""
         self.state = state
 
@@ -143,15 +227,23 @@ class PhoneModem:  # pylint: disable=too-many-instance-attributes
 
     def _get_lines(self) -> list[str]:
         """Return response from last modem command, including blank lines."""
-        return self.cmd_responselines
+        return list(self.cmd_responselines)
 
     async def close(self) -> None:
-        """Close modem port, exit worker thread."""
+        """Close modem port, stop the state machine."""
         if self.ser:
             self.ser.close()
             self.ser = None
-
-    async def _open(self) -> None:
+        # When reconnecting, close is called from the state machine itself
+        if (task := self._sm_task) and task is not asyncio.current_task():
+            self._sm_task = None
+            if not task.done():
+                task.cancel()
+                await asyncio.wait((task,))
+            if not task.cancelled() and (ex := task.exception()):
+                _LOGGER.error("Modem state machine exited with error: %s", ex)
+
+    def _open(self) -> None:
         """Open modem port."""
         if self.ser:
             self.ser.open()
@@ -165,93 +257,112 @@ class PhoneModem:  # pylint: disable=too-many-instance-attributes
     async def _retry(self) -> None:
         """Retry connecting.
 
-        This goes on forever in the state machine thread until connection is regained."""
-        await asyncio.sleep(10)
-        try:
-            return await self._reset()
-        except exceptions.SerialError:
-            await self._retry()
+        This goes on forever in the state machine thread until connection is regained,
+        doubling the delay between attempts up to RETRY_MAX_DELAY."""
+        delay = RETRY_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                return await self._reset()
+            except exceptions.SerialError:
+                delay = min(delay * 2, RETRY_MAX_DELAY)
+
+    def _handle_cid_date(self, _: bytes) -> None:
+        """Record the time of the incoming call."""
+        self._cid_time_ns = time.time_ns()
+
+    def _handle_cid_number(self, data: bytes) -> None:
+        """Record the number of the incoming call."""
+        self.cid_number = data.decode()
+
+    def _handle_cid_name(self, data: bytes) -> None:
+        """Record the name of the incoming call and report caller id."""
+        self.cid_name = data.decode()
+        self._set_state(self.STATE_CALLERID)
+        self.incomingcallnotificationfunc(self.state)
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug(
+                "CID: %s %s %s",
+                self.cid_time.strftime("%I:%M %p"),
+                self.cid_name,
+                self.cid_number,
+            )
+
+    _CID_HANDLERS = {
+        _TAG_DATE: _handle_cid_date,
+        _TAG_NMBR: _handle_cid_number,
+        _TAG_NAME: _handle_cid_name,
+    }
 
     async def _modem_sm(  # pylint: disable=[too-many-statements, too-many-branches]
         self, timeout: int | None = READ_IDLE_TIMEOUT
     ) -> None:
         """Handle modem response state machine."""
         read_timeout = timeout
-        while self.ser:
-            try:
-                resp = await self._read(read_timeout)
-            except (SerialException, SystemExit, TypeError):
-                # Sleep a bit to allow main thread to remove serial
-                await asyncio.sleep(0.1)
-                if self.ser and self.retry:
-                    _LOGGER.debug("Unable to read from port %s", self.port)
-                    return await self._retry()
-                break
-
-            if self.state != self.STATE_IDLE and not resp:
-                read_timeout = READ_IDLE_TIMEOUT
-                await self._set_state(self.STATE_IDLE)
-                self.incomingcallnotificationfunc(self.state)
-                continue
-
-            resp = resp.decode()
-            resp = resp.strip("\r\n")
-            if self.cmd_response == "":
-                self.cmd_responselines.append(resp)
-            _LOGGER.debug("mdm: %s", resp)
-
-            if resp in ("OK", "ERROR"):
-                self.cmd_response = resp
-                continue
-
-            if resp == "RING":
-                if self.state == self.STATE_IDLE:
-                    self.cid_name = ""
-                    self.cid_number = ""
-                    self.cid_time = datetime.now()
-
-                await self._set_state(self.STATE_RING)
-                self.incomingcallnotificationfunc(self.state)
-                read_timeout = READ_RING_TIMEOUT
-                continue
-
-            if len(resp) <= 4 or resp.find("=") == -1:
-                continue
-
-            read_timeout = READ_RING_TIMEOUT
-            cid_field, cid_data = resp.split("=")
-            cid_field = cid_field.strip()
-            cid_data = cid_data.strip()
-            if cid_field == "DATE":
-                self.cid_time = datetime.now()
-                continue
-
-            if cid_field == "NMBR":
-                self.cid_number = cid_data
-                continue
-
-            if cid_field == "NAME":
-                self.cid_name = cid_data
-                await self._set_state(self.STATE_CALLERID)
-                self.incomingcallnotificationfunc(self.state)
-                _LOGGER.debug(
-                    "CID: %s %s %s",
-                    self.cid_time.strftime("%I:%M %p"),
-                    self.cid_name,
-                    self.cid_number,
-                )
+        try:
+            while self.ser:
                 try:
-                    await self._write(self.cmd_callerid)
-                except SerialException:
-                    _LOGGER.error("Unable to write to port %s", self.port)
+                    resp = await self._read(read_timeout)
+                except (SerialException, SystemExit, TypeError):
+                    # Sleep a bit to allow main thread to remove serial
+                    await asyncio.sleep(0.1)
+                    if self.ser and self.retry:
+                        _LOGGER.debug("Unable to read from port %s", self.port)
+                        return await self._retry()
                     break
 
-        await self._set_state(self.STATE_FAILED)
-        _LOGGER.debug("Exiting modem state machine")
+                if self.state != self.STATE_IDLE and not resp:
+                    read_timeout = READ_IDLE_TIMEOUT
+                    self._set_state(self.STATE_IDLE)
+                    self.incomingcallnotificationfunc(self.state)
+                    continue
+
+                resp = resp.strip(b"\r\n")
+                if self.cmd_response == "":
+                    self.cmd_responselines.append(resp.decode())
+                if _LOGGER.isEnabledFor(logging.DEBUG):
+                    _LOGGER.debug("mdm: %s", resp.decode())
+
+                if resp in _TERMINALS:
+                    self.cmd_response = resp.decode()
+                    self._resp_event.set()
+                    continue
+
+                if resp == _RING:
+                    if self.state == self.STATE_IDLE:
+                        self.cid_name = ""
+                        self.cid_number = ""
+                        self._cid_time_ns = time.time_ns()
+
+                    self._set_state(self.STATE_RING)
+                    self.incomingcallnotificationfunc(self.state)
+                    read_timeout = READ_RING_TIMEOUT
+                    continue
+
+                if (cid_match := _CID_RE.fullmatch(resp)) is None:
+                    continue
+
+                read_timeout = READ_RING_TIMEOUT
+                cid_field, cid_data = cid_match.groups()
+                if (handler := self._CID_HANDLERS.get(cid_field)) is None:
+                    continue
+
+                handler(self, cid_data)
+                if cid_field == _TAG_NAME:
+                    try:
+                        await self._write(self.cmd_callerid)
+                    except SerialException:
+                        _LOGGER.error("Unable to write to port %s", self.port)
+                        break
+        finally:
+            # A reconnect hands over to a new state machine, leave its state alone
+            if self._sm_task in (None, asyncio.current_task()):
+                self._set_state(self.STATE_FAILED)
+            _LOGGER.debug("Exiting modem state machine")
 
     async def accept_call(self) -> None:
         """Accept an incoming call."""
-        await self._sendcmd("ATA")
+        await self._sendcmd(_CMD_ATA)
 
     async def reject_call(self) -> None:
         """Reject an incoming call.
@@ -265,31 +376,52 @@ class PhoneModem:  # pylint: disable=too-many-instance-attributes
     async def hangup_call(self) -> None:
         """Terminate the currently ongoing call."""
         await self._set_class()
-        await self._sendcmd("ATH")
+        await self._sendcmd(_CMD_ATH)
 
     async def _set_class(self, mode: int = 8) -> None:
         """Set the mode for the modem."""
-        await self._sendcmd(f"AT+FCLASS={mode}")
+        await self._sendcmd(_CMD_FCLASS.get(mode) or f"AT+FCLASS={mode}")
 
     async def send_audio(
         self,
         file: str,
         vsm_method: int | None = None,
         sample_rate: int = 8000,
-        interval: float = 0.12,
+        interval: float | None = None,
+        chunk_frames: int | None = None,
     ) -> None:
         """Send a wave audio file recorded with Audacity. Works regardless of a connected call.
 
-        Recommended 8000Hz Mono Unsigned 8-bit PCM. Adjust interval if audio sounds choppy."""
+        Recommended 8000Hz Mono Unsigned 8-bit PCM. By default 125ms chunks are
+        sent at the modem's sample rate, one chunk ahead of playback. Adjust
+        interval if audio sounds choppy."""
         assert self.ser is not None
-        audio = wave.open(file, "rb")
+        chunk_frames = chunk_frames or sample_rate // 8
+        if interval is None:
+            interval = chunk_frames / sample_rate
+        with wave.open(file, "rb") as audio:
+            chunk_size = chunk_frames * audio.getsampwidth() * audio.getnchannels()
+            # Slicing avoids copying the file, pyserial still copies each chunk on write
+            data = memoryview(audio.readframes(audio.getnframes()))
+            duration = audio.getnframes() / sample_rate
         await self._set_class()
-        await self._sendcmd(f"AT+VSM={vsm_method or self.vsm_method},{sample_rate}")
-        await self._sendcmd("AT+VLS=1")
+        await self._sendcmd_batch(
+            [f"AT+VSM={vsm_method or self.vsm_method},{sample_rate}", "AT+VLS=1"]
+        )
         await self._sendcmd("AT+VTX")
         await asyncio.sleep(1)
-        while frame := audio.readframes(1024):
-            await self.ser.write_async(frame)
-            await asyncio.sleep(interval)
-
+        loop = asyncio.get_running_loop()
+        write = self.ser.write_async
+        start = loop.time()
+        # Start one chunk early so the modem always has a chunk buffered ahead
+        deadline = start - interval
+        for i in range(0, len(data), chunk_size):
+            await write(data[i : i + chunk_size])
+            deadline += interval
+            if (delay := deadline - loop.time()) > 0:
+                await asyncio.sleep(delay)
+
+        # Closing the port ends voice transmit, let the buffered audio play out
+        if (delay := start + duration - loop.time()) > 0:
+            await asyncio.sleep(delay)
         await self._reset()
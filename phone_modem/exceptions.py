@@ -4,6 +4,10 @@
 class SerialError(Exception):
     """When a connection error is encountered."""
 
+    __slots__ = ()
+
 
 class ResponseError(Exception):
-    """When a connection error is encountered."""
+    """When the modem does not respond or rejects a command."""
+
+    __slots__ = ()